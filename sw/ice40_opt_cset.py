@@ -7,7 +7,52 @@
 # SPDX-License-Identifier: MIT
 #
 
-from collections import namedtuple
+from collections import Counter, namedtuple
+import functools
+import sys
+
+
+# FF types where R/S are asynchronous (and so can't be moved to logic)
+ASYNC_SR_TYPES = ('SB_DFFR', 'SB_DFFS', 'SB_DFFER', 'SB_DFFES')
+
+# FF type after removal of RS (conv bit 0) and/or ENA (conv bit 1)
+TYPE_CONVERT = {
+	('SB_DFF' + n + e + sr, conv): 'SB_DFF' + n +
+		('' if (conv & 2) else e) +
+		('' if ((conv & 1) and (sr in ('SR', 'SS'))) else sr)
+		for n    in ('', 'N')
+		for e    in ('', 'E')
+		for sr   in ('', 'SR', 'SS', 'R', 'S')
+		for conv in range(1,4)
+}
+
+# For each LUT input, mask of the LUT_INIT bits selected when that input is 1
+BIT_MASKS = [sum(1 << i for i in range(16) if i & (1 << p)) for p in range(4)]
+
+
+@functools.lru_cache(maxsize=None)
+def lut_init_masks(pn_rs, rs_val, pn_ena, pn_old):
+	"""(and_mask, or_mask) to apply to a LUT_INIT value to implement the
+	given reset/set and enable inputs"""
+	and_mask = 0xffff
+	or_mask  = 0
+
+	# Handle reset/set: force all bits where rs input is 1
+	if pn_rs is not None:
+		rs_mask = BIT_MASKS[pn_rs]
+		if rs_val:
+			or_mask  |=  rs_mask
+		else:
+			and_mask &= ~rs_mask
+
+	# Handle enable: where ena input is 0, output follows the old value input
+	if pn_ena is not None:
+		ena_zero = ~BIT_MASKS[pn_ena] & 0xffff
+		old_one  = BIT_MASKS[pn_old]
+		and_mask &= ~ena_zero
+		or_mask   = (or_mask & ~ena_zero) | (ena_zero & old_one)
+
+	return and_mask & 0xffff, or_mask
 
 
 #
@@ -16,6 +61,14 @@ from collections import namedtuple
 #
 
 
+def port_net_name(cell, port_name):
+	"""Name of the net connected to a cell port, or None if unconnected/absent"""
+	if port_name not in cell.ports:
+		return None
+	net = cell.ports[port_name].net
+	return net.name if net is not None else None
+
+
 class ControlSet(namedtuple('ControlSet', 'rs ena clk')):
 
 	__slots__ = []
@@ -25,12 +78,31 @@ class ControlSet(namedtuple('ControlSet', 'rs ena clk')):
 		if not cell.type.startswith('SB_DFF'):
 			raise ValueError("Invalid cell type")
 
-		net_r = cell.ports['R'].net.name if (('R' in cell.ports) and (cell.ports['R'].net is not None)) else None
-		net_s = cell.ports['S'].net.name if (('S' in cell.ports) and (cell.ports['S'].net is not None)) else None
-		net_e = cell.ports['E'].net.name if (('E' in cell.ports) and (cell.ports['E'].net is not None)) else None
-		net_c = cell.ports['C'].net.name if (('C' in cell.ports) and (cell.ports['C'].net is not None)) else None
+		return kls.from_nets(
+			port_net_name(cell, 'R'),
+			port_net_name(cell, 'S'),
+			port_net_name(cell, 'E'),
+			port_net_name(cell, 'C'),
+		)
 
-		return kls(net_r or net_s, net_e, net_c)
+	@classmethod
+	def from_nets(kls, net_r, net_s, net_e, net_c):
+		# Names are interned so that equality checks during the many dict
+		# lookups of the optimizer mostly boil down to identity checks
+		net_rs = net_r or net_s
+		return kls(
+			sys.intern(net_rs) if net_rs else None,
+			sys.intern(net_e)  if net_e  else None,
+			sys.intern(net_c)  if net_c  else None,
+		)
+
+	def convert(self, conv):
+		"""Control set resulting from removing RS (conv bit 0) and/or ENA (conv bit 1)"""
+		return ControlSet(
+			None if (conv & 1) else self.rs,
+			None if (conv & 2) else self.ena,
+			self.clk
+		)
 
 
 class ControlSetOptimizer:
@@ -38,43 +110,78 @@ class ControlSetOptimizer:
 	def __init__(self, ctx):
 		self.ctx = ctx
 
-		self.global_nets = self.find_global_nets()
-		self.cset_map = self.build_map()
+		# Caches (keyed by name since binding objects are transient)
+		self._netname_cache = {}
+		self._lut_info      = {}	# LUT name -> free ports
+		self._driver_cache  = {}	# FF name  -> (driver_cell, n_users, free_ports)
+		self._driver_deps   = {}	# Net name -> FF names whose driver info depends on it
+		self._lut_init_int  = {}	# LUT name -> LUT_INIT as int
+
+		self._flags = {}		# Control set -> bit0: has removable R/S, bit1: has E
 
-	def find_global_nets(self):
-		"""List all nets (names) that are output from global buffers"""
-		return set([
-			c[1].ports['GLOBAL_BUFFER_OUTPUT'].net.name
-				for c in self.ctx.cells
-				if c[1].type=='SB_GB'
-		])
+		self.global_nets, self.cset_map = self._scan_cells()
 
-	def build_map(self):
+	def _scan_cells(self):
+		"""Single pass over all cells to collect the nets (names) that are
+		output from global buffers and the control set map, and to precompute
+		LUT free ports"""
 		# Init
+		global_nets = set()
 		cset_map = {}
+		async_sr = set()
 
 		# Scan all cells
 		for cell_name, cell in self.ctx.cells:
-			# Only consider FFs
-			if not cell.type.startswith('SB_DFF'):
-				continue
+			t = cell.type
+
+			# Global buffers
+			if t == 'SB_GB':
+				global_nets.add(cell.ports['GLOBAL_BUFFER_OUTPUT'].net.name)
 
-			# Add cell
-			cset = ControlSet.from_cell(cell)
-			cset_map.setdefault(cset, []).append(cell)
+			# LUTs: precompute free ports of those that could absorb FF logic
+			# (i.e. whose output has a single user)
+			elif t == 'SB_LUT4':
+				on = cell.ports['O'].net
+				if (on is not None) and (len(on.users) == 1):
+					self._lut_free_ports(cell)
 
-		return cset_map
+			# FFs
+			elif t.startswith('SB_DFF'):
+				# Add cell
+				cset = ControlSet.from_cell(cell)
+				cset_map.setdefault(cset, []).append(cell)
 
-	def stats(self):
-		"""Print some statistics"""
+				if t in ASYNC_SR_TYPES:
+					async_sr.add(cset)
+
+		# Conversions possible for each control set
+		self._flags = {
+			cset: self._cset_flags(cset, cset not in async_sr)
+				for cset in cset_map
+		}
+
+		return global_nets, cset_map
+
+	def _cset_flags(self, cset, rs_ok):
+		# bit0: has R/S that can be removed (i.e. not used as async set/reset)
+		# bit1: has E
+		has_rs  = rs_ok and (cset.rs  is not None) # and (cset.rs  not in self.global_nets)
+		has_ena =           (cset.ena is not None) # and (cset.ena not in self.global_nets)
+		return (1 if has_rs else 0) | (2 if has_ena else 0)
+
+	def stats_summary(self):
+		"""Print some statistics: histogram of control set sizes"""
 
 		print(f"Total control sets: {len(self.cset_map):d}")
-		csl = {}
-		for k, v in self.cset_map.items():
-			csl.setdefault(len(v), []).append( (k, v) )
 
-		for k, v in sorted(csl.items(), key=lambda x: x[0]):
-			print(k, len(v))
+		hist = Counter(len(v) for v in self.cset_map.values())
+		for k, v in sorted(hist.items()):
+			print(k, v)
+
+	def stats_verbose(self):
+		"""Print some statistics, including every control set"""
+
+		self.stats_summary()
 
 		for k, v in sorted(self.cset_map.items(), key=lambda x: len(x[1])):
 			print(len(v), k)
@@ -83,9 +190,15 @@ class ControlSetOptimizer:
 	def _net_name_simplify(self, net):
 		if net is None:
 			return None
-		if net.driver.cell.type in ['GND', 'VCC']:
-			return net.driver.cell.type
-		return net.name
+		name = net.name
+		try:
+			return self._netname_cache[name]
+		except KeyError:
+			pass
+		t = net.driver.cell.type
+		rv = t if t in ['GND', 'VCC'] else name
+		self._netname_cache[name] = rv
+		return rv
 
 	def _unused_port(self, cell, port_name):
 		n = cell.ports[port_name].net
@@ -123,6 +236,17 @@ class ControlSetOptimizer:
 		return False
 
 	def _lut_free_ports(self, cell):
+		"""Free input ports of a LUT. Precomputed in _scan_cells and computed on
+		demand for LUTs created / modified since"""
+		try:
+			return self._lut_info[cell.name]
+		except KeyError:
+			pass
+		rv = self._scan_lut_free_ports(cell)
+		self._lut_info[cell.name] = rv
+		return rv
+
+	def _scan_lut_free_ports(self, cell):
 		# First pass
 		free_ports = [ p
 			for p in ['I0', 'I1', 'I2', 'I3']
@@ -135,9 +259,45 @@ class ControlSetOptimizer:
 				if p in free_ports:
 					free_ports.remove(p)
 
-		return free_ports
+		return tuple(free_ports)
 
-	def cost_convert(self, cset, conv):
+	def _driver_info(self, cell):
+		"""Returns (driver_cell, n_users, free_ports) for the driver of a FF 'D' input
+
+		n_users is None if the driver is not a LUT and free_ports is only
+		filled if the LUT has no other user than this FF
+		"""
+		try:
+			return self._driver_cache[cell.name]
+		except KeyError:
+			pass
+
+		net = cell.ports['D'].net
+		driver_cell = net.driver.cell
+		n_users = None
+		free_ports = ()
+
+		if driver_cell.type == 'SB_LUT4':
+			n_users = len(driver_cell.ports['O'].net.users)
+			if n_users == 1:
+				free_ports = self._lut_free_ports(driver_cell)
+
+		rv = (driver_cell, n_users, free_ports)
+		self._driver_cache[cell.name] = rv
+		self._driver_deps.setdefault(net.name, set()).add(cell.name)
+		return rv
+
+	def _driver_invalidate(self, net_name):
+		# Drop driver info of all FFs whose 'D' input is on that net
+		for n in self._driver_deps.pop(net_name, ()):
+			self._driver_cache.pop(n, None)
+
+	def cost_convert(self, cset, conv, cap=None):
+		"""Cost (# of new LUTs) of a conversion
+
+		If cap is given, returns as soon as the cost exceeds it (so the
+		returned cost is then only a lower bound, still above cap)
+		"""
 		# Init
 		rm_rs  = bool(conv & 1)
 		rm_ena = bool(conv & 2)
@@ -148,57 +308,45 @@ class ControlSetOptimizer:
 		# Scan all cells in that set
 		for cell in self.cset_map[cset]:
 			# Get cell driving that FF
-			driver_cell = cell.ports['D'].net.driver.cell
+			driver_cell, n_users, free_ports = self._driver_info(cell)
 
 			# If it's not a LUT already, then we can put a LUT in front for free, always
-			if driver_cell.type != 'SB_LUT4':
+			if n_users is None:
 				continue
 
 			# If there is more than one user of the LUT, we always need a new one
 			# and it comes for free since it wouldn't have been packable in the same LC
 			# anyway
-			if len(driver_cell.ports['O'].net.users) > 1:
+			if n_users > 1:
 				continue
 
 			# Count how many LUT inputs are 'free'
-			free_ports = self._lut_free_ports(driver_cell)
 			if len(free_ports) < n_in:
 				cost = cost + 1
+				if (cap is not None) and (cost > cap):
+					break
 
 		# Return cost of conversion
 		return cost
 
 	def can_convert(self, cset, conv):
-		# What do we want to remove
-		rm_rs  = bool(conv & 1)
-		rm_ena = bool(conv & 2)
-
-		# What do we have
-		has_rs  = (cset.rs  is not None) # and (cset.rs  not in self.global_nets)
-		has_ena = (cset.ena is not None) # and (cset.ena not in self.global_nets)
-
-		# If the reset is used for asynchronous set/reset, we can't remove it
-		if has_rs:
-			for c in self.cset_map[cset]:
-				if c.type in ['SB_DFFR', 'SB_DFFS', 'SB_DFFER', 'SB_DFFES']:
-					has_rs = False
-					break
+		# What do we have (see _cset_flags)
+		flags = self._flags[cset]
+		has_rs = bool(flags & 1)
 
 		# Does that conversion make sense
-		if rm_rs and not has_rs:
-			return False
-		if rm_ena and not has_ena:
+		if (conv & flags) != conv:
 			return False
 
 		# If we remove an ENA and there is a reset, that can be an issue because ENA
 		# has precedence ...
 
 		# FIXME:
-		# If the 'has_xxx' above excludes global nets, then this check kind of
+		# If the 'has_xxx' in _cset_flags excludes global nets, then this check kind of
 		# consider that 'global' resets have precedence which is not true in hardware :/
 		# We could check the generation of the ena signal to see if having rs=1 implies
 		# ena=1 but that's quite a bit of logic to do that ...
-		if has_rs and (rm_ena and not rm_rs):
+		if has_rs and (conv == 2):
 			return False
 
 		return True
@@ -209,57 +357,64 @@ class ControlSetOptimizer:
 		rm_ena = bool(conv & 2)
 		n_in   = (2 * rm_ena) + (1 * rm_rs)
 
+		# Local aliases, called several times per converted cell
+		# (nextpnr has no bulk netlist edit API to batch those)
+		disconnect  = self.ctx.disconnectPort
+		connect     = self.ctx.connectPort
+		create_cell = self.ctx.createCell
+		create_net  = self.ctx.createNet
+		invalidate  = self._driver_invalidate
+
 		# Update every cell
 		for cell in self.cset_map[cset]:
+			cell_name = cell.name
+
 			# Disconnect from FF and adapt cell type
 			t = cell.type
 			set_reset = 'SS' in t
 
-			has_rs = ('SR' in t) or ('SS' in t)
-
 			if rm_rs:
-				self.ctx.disconnectPort(cell.name, 'R')
-				self.ctx.disconnectPort(cell.name, 'S')
-				t = t.replace('SR', '').replace('SS', '')
+				disconnect(cell_name, 'R')
+				disconnect(cell_name, 'S')
 
 			if rm_ena:
-				self.ctx.disconnectPort(cell.name, 'E')
-				t = t.replace('E', '')
+				disconnect(cell_name, 'E')
 
-			cell.type = t
+			cell.type = TYPE_CONVERT[(t, conv)]
 
 			# Get cell driving that FF
-			driver_cell = cell.ports['D'].net.driver.cell
-
 			# If it's not a LUT, we need to insert a lut ...
 			# If it is, we collect free ports
 			# Also need to check that LUT is only used once !
-			free_ports = []
+			# (free_ports is only filled in that case)
+			driver_cell, n_users, free_ports = self._driver_info(cell)
+			free_ports = list(free_ports)
 
-			if (driver_cell.type == 'SB_LUT4') and (len(driver_cell.ports['O'].net.users) == 1):
-				free_ports = self._lut_free_ports(driver_cell)
+			# We're about to edit the netlist around this FF and its driver
+			old_net_name = cell.ports['D'].net.name
+			invalidate(old_net_name)
 
 			# Do we need a new lut or alter the existing one ?
 			if len(free_ports) < n_in:
 				# Insert a new LUT
-				new_lut = self.ctx.createCell(cell.name + '_conv', 'SB_LUT4')
+				new_lut = create_cell(cell_name + '_conv', 'SB_LUT4')
 				new_lut.addInput('I0')
 				new_lut.addInput('I1')
 				new_lut.addInput('I2')
 				new_lut.addInput('I3')
 				new_lut.addOutput('O')
-				new_lut.setParam('LUT_INIT', '1111111100000000')
+				tgt_name = new_lut.name
+				self._lut_init_int[tgt_name] = 0xff00	# Written back below
 
 				# New net
-				new_net = self.ctx.createNet(cell.name + '_net')
+				new_net_name = create_net(cell_name + '_net').name
+				self._netname_cache.pop(new_net_name, None)
 
 				# Interpose out new LUT
-				old_net = cell.ports['D'].net
-
-				self.ctx.disconnectPort(cell.name, 'D')
-				self.ctx.connectPort(old_net.name, new_lut.name, 'I3')
-				self.ctx.connectPort(new_net.name, new_lut.name, 'O')
-				self.ctx.connectPort(new_net.name, cell.name, 'D')
+				disconnect(cell_name, 'D')
+				connect(old_net_name, tgt_name, 'I3')
+				connect(new_net_name, tgt_name, 'O')
+				connect(new_net_name, cell_name, 'D')
 
 				# Freeports on this lut
 				tgt_lut = new_lut
@@ -267,6 +422,10 @@ class ControlSetOptimizer:
 
 			else:
 				tgt_lut = driver_cell
+				tgt_name = tgt_lut.name
+
+			# Free ports of the target LUT will change
+			self._lut_info.pop(tgt_name, None)
 
 			# Connect target LUT
 			if rm_rs:
@@ -275,8 +434,9 @@ class ControlSetOptimizer:
 				pn_rs = int(p_rs[1:])
 
 				# Connect signals
-				self.ctx.disconnectPort(tgt_lut.name, p_rs)
-				self.ctx.connectPort(cset.rs, tgt_lut.name, p_rs)
+				disconnect(tgt_name, p_rs)
+				connect(cset.rs, tgt_name, p_rs)
+				invalidate(cset.rs)
 			else:
 				pn_rs = None
 
@@ -288,65 +448,71 @@ class ControlSetOptimizer:
 				pn_old = int(p_old[1:])
 
 				# Connect signals
-				self.ctx.disconnectPort(tgt_lut.name, p_ena)
-				self.ctx.disconnectPort(tgt_lut.name, p_old)
-				self.ctx.connectPort(cset.ena, tgt_lut.name, p_ena)
-				self.ctx.connectPort(cell.ports['Q'].net.name, tgt_lut.name, p_old)
+				q_net_name = cell.ports['Q'].net.name
+
+				disconnect(tgt_name, p_ena)
+				disconnect(tgt_name, p_old)
+				connect(cset.ena, tgt_name, p_ena)
+				connect(q_net_name, tgt_name, p_old)
+				invalidate(cset.ena)
+				invalidate(q_net_name)
 			else:
 				pn_ena = None
 				pn_old = None
 
 			# Modify LUT content
-			tgt_lut.setParam('LUT_INIT', self._update_lut_init(
-				tgt_lut.params['LUT_INIT'],
+			init = self._update_lut_init(
+				self._get_init(tgt_lut),
 				pn_rs, set_reset,
 				pn_ena, pn_old
-			))
+			)
+			self._lut_init_int[tgt_name] = init
+			tgt_lut.setParam('LUT_INIT', format(init, '016b'))
 
 			# Connect remaining free ports to 'GND' if they're still unconnected
 			# FIXME
 
+	def _get_init(self, cell):
+		"""LUT_INIT of a LUT as int (only parsed once per LUT)"""
+		try:
+			return self._lut_init_int[cell.name]
+		except KeyError:
+			pass
+		rv = int(cell.params['LUT_INIT'], 2)
+		self._lut_init_int[cell.name] = rv
+		return rv
+
 	def _update_lut_init(self, val, pn_rs, rs_val, pn_ena, pn_old):
-		# Convert value to int
-		val = int(val, 2)
-
-		# Scan all bits
-		for i in range(16):
-			mask = 1 << i
-
-			# Handle reset/set
-			if (pn_rs is not None) and (i & (1 << pn_rs)):
-				if rs_val:
-					# Set bit
-					val |=  mask
-				else:
-					# Clear bit
-					val &= ~mask
-
-			# Handle enable
-			if (pn_ena is not None) and not (i & (1 << pn_ena)):
-				if (i & (1 << pn_old)):
-					# Set bit
-					val |=  mask
-				else:
-					# Clear bit
-					val &= ~mask
-
-		# Convert value back
-		return f'{val:016b}'
+		# Masks only depend on the port assignment, shared by many conversions
+		and_mask, or_mask = lut_init_masks(pn_rs, bool(rs_val), pn_ena, pn_old)
+		return (val & and_mask) | or_mask
 
 	def optimize(self, threshold=4, debug=False):
 		# Init loop
 			# Sort to be consistent across run ...
-		to_process = sorted(self.cset_map.keys(), key=lambda x: (x[0] or '', x[1] or '', x[2] or ''))
+			# (dict used as an ordered set for O(1) membership test / removal)
+		to_process = dict.fromkeys(sorted(self.cset_map.keys(), key=lambda x: (x[0] or '', x[1] or '', x[2] or '')))
 		cset_cnt_before = len(self.cset_map)
 		total_cost = 0
 
+		# Index pending control sets by the target they'd have for each conversion
+		# (dicts are used as ordered sets to keep the same order as to_process)
+		group_index = [None, {}, {}, {}]
+
+		for x in to_process:
+			for conv in range(1,4):
+				group_index[conv].setdefault(x.convert(conv), {})[x] = None
+
+		def group_index_remove(x):
+			for conv in range(1,4):
+				group_index[conv][x.convert(conv)].pop(x, None)
+
 		# Process while there are control sets in the pool
 		while len(to_process):
 			# Pick one
-			cset = to_process.pop()
+			cset, _ = to_process.popitem()
 			cells = self.cset_map[cset]
+			group_index_remove(cset)
 
 			# Don't bother trying to consolidate sets that are well used
 			if len(cells) >= threshold:
@@ -354,21 +520,15 @@ class ControlSetOptimizer:
 
 			# We can remove RS,E or both. Evaluate result and cost for all 3
 			possible_tgt = []
+			best = None
 
 			for conv in range(1,4):
 				# Make sure that option makes senses
 				if not self.can_convert(cset, conv):
 					continue
 
-				# What do we want to remove
-				rm_rs  = bool(conv & 1)
-				rm_ena = bool(conv & 2)
-
-				tgt = ControlSet(
-					None if rm_rs  else cset.rs,
-					None if rm_ena else cset.ena,
-					cset.clk
-				)
+				# Resulting control set
+				tgt = cset.convert(conv)
 
 				# Number of cells in potential resulting group
 				cell_in_group = len(cells)
@@ -380,16 +540,9 @@ class ControlSetOptimizer:
 
 				# Maybe applying the same conversion to other control set would bring them in-line
 				if tgt.rs or tgt.ena:
-					for alt_cset in to_process:
-						# Possible alt targets
-						alt_cells = self.cset_map[alt_cset]
-						alt_tgt = ControlSet(
-							None if rm_rs  else alt_cset.rs,
-							None if rm_ena else alt_cset.ena,
-							alt_cset.clk
-						)
-
+					for alt_cset in group_index[conv].get(tgt, ()):
 						# Only consider low-cell control sets
+						alt_cells = self.cset_map[alt_cset]
 						if len(alt_cells) >= threshold:
 							continue
 
@@ -397,20 +550,30 @@ class ControlSetOptimizer:
 						if not self.can_convert(alt_cset, conv):
 							continue
 
-						# Check it's a match
-						if tgt == alt_tgt:
-							# Ok, that's a possibility count possible cells in resulting group
-							cell_in_group += len(alt_cells)
-							cset_in_group.append(alt_cset)
+						# Ok, that's a possibility count possible cells in resulting group
+						cell_in_group += len(alt_cells)
+						cset_in_group.append(alt_cset)
 
 				# If at this point, we don't have enough, discard that option
 				if cell_in_group < threshold:
 					continue
 
+				# Evaluate cost, no need to be exact once we know it's worse than
+				# the best option so far (ties are still evaluated fully)
+				cap = None if (best is None) else ((best[0] * len(cset_in_group)) // best[1])
+				cost = 0
+				for x in cset_in_group:
+					cost += self.cost_convert(x, conv, None if (cap is None) else (cap - cost))
+					if (cap is not None) and (cost > cap):
+						break
+
 				# Record result
-				cost = sum( [self.cost_convert(x, conv) for x in cset_in_group] )
 				possible_tgt.append( (tgt, conv, cost, cell_in_group, cset_in_group) )
 
+				# Track best cost per control set (as an exact cost, n_csets fraction)
+				if (best is None) or (cost * best[1] < best[0] * len(cset_in_group)):
+					best = (cost, len(cset_in_group))
+
 			# Nothing to do ?
 			if len(possible_tgt) == 0:
 				continue
@@ -434,11 +597,17 @@ class ControlSetOptimizer:
 
 				# Update state variable
 				if cset_cur in to_process:
-					to_process.remove(cset_cur)
+					del to_process[cset_cur]
+					group_index_remove(cset_cur)
 
 				cells_cur = self.cset_map.pop(cset_cur)
 				self.cset_map.setdefault(tgt,[]).extend(cells_cur)
 
+				# R/S of the result is only removable if it was for all merged sets
+				# (a set with async set/reset users only ever has its E removed)
+				rs_ok = self._flags.pop(cset_cur) & self._flags.get(tgt, 1) & 1
+				self._flags[tgt] = self._cset_flags(tgt, rs_ok)
+
 			total_cost += cost
 
 		cset_cnt_after = len(self.cset_map)
@@ -447,8 +616,9 @@ class ControlSetOptimizer:
 
 
 def run_opt(ctx, threshold=4, debug=False):
-	debug = True
 	opt = ControlSetOptimizer(ctx)
 	opt.optimize(threshold=threshold, debug=debug)
 	if debug:
-		opt.stats()
+		opt.stats_verbose()
+	else:
+		opt.stats_summary()
@@ -36,37 +36,41 @@ def run_opt(ctx):
 		cnt_grp += 1
 		cnt_new += len(ff) - 1
 
+		# Collect what we need from the source LUT once
+		in_ports = [pn for pn in ['I0', 'I1', 'I2', 'I3'] if pn in ci.ports]
+		in_nets  = [(pn, ci.ports[pn].net.name) for pn in in_ports if ci.ports[pn].net is not None]
+		attrs    = list(ci.attrs)
+		params   = list(ci.params)
+		ci_name  = ci.name
+		on_name  = ci.ports['O'].net.name
+
 		# Duplicate as needed
 		for i,d in enumerate(ff[1:]):
-			# Get previous data
-			on = ci.ports['O'].net
-
 			# New Cell
-			nc = ctx.createCell(ci.name + '_dup' + str(i), 'SB_LUT4')
+			nc = ctx.createCell(ci_name + '_dup' + str(i), 'SB_LUT4')
+			nc_name = nc.name
 
 				# Copy inputs
-			for pn in ['I0', 'I1', 'I2', 'I3']:
-				if pn not in ci.ports:
-					continue
+			for pn in in_ports:
 				nc.addInput(pn)
-				if ci.ports[pn] is None:
-					continue
-				ctx.connectPort(ci.ports[pn].net.name, nc.name, pn)
+			for pn, net_name in in_nets:
+				ctx.connectPort(net_name, nc_name, pn)
 
 				# Create output
 			nc.addOutput('O')
 
 				# Copy config
-			for an,av in ci.attrs:
+			for an,av in attrs:
 				nc.setAttr(an,av)
-			for pn,pv in ci.params:
+			for pn,pv in params:
 				nc.setParam(pn,pv)
 
 			# Rewire
-			ctx.disconnectPort(d.cell.name, 'D')
+			d_name = d.cell.name
+			ctx.disconnectPort(d_name, 'D')
 
-			nn = ctx.createNet(on.name + '_dup' + str(i))
-			ctx.connectPort(nn.name, d.cell.name, 'D')
-			ctx.connectPort(nn.name, nc.name, 'O')
+			nn = ctx.createNet(on_name + '_dup' + str(i))
+			ctx.connectPort(nn.name, d_name, 'D')
+			ctx.connectPort(nn.name, nc_name, 'O')
 
 	print("LUT replication: %d new LUTs in %d groups" % (cnt_new, cnt_grp))
@@ -6,6 +6,9 @@
 # SPDX-License-Identifier: MIT
 #
 
+from collections import defaultdict
+
+
 CELLS = {
 	'ICESTORM_LC':    (   'LC', 5),
 	'ICESTORM_RAM':   (  'RAM', 2),
@@ -17,7 +20,15 @@ CELLS = {
 class UsageTracker:
 
 	def __init__(self):
-		self.usage = {}
+		self.usage = self._new_node()
+
+	@staticmethod
+	def _new_node():
+		# 'counts' maps cell type to [n_self, n_sub]
+		return {
+			'counts':   defaultdict(lambda: [0, 0]),
+			'children': {},
+		}
 
 	def add_cell(self, c):
 		# Only count cell we're interested in
@@ -26,22 +37,25 @@ class UsageTracker:
 
 		# Path & element name
 		path = c.name.split('.')
-		en = '_' + c.type
+		en = c.type
+		last = len(path) - 1
 
 		# Add usage  at every level
 		b = self.usage
 
-		for i, c in enumerate(path):
+		for i, pn in enumerate(path):
 			# Update self current usage
-			n_self, n_sub = b.setdefault(en, (0, 0))
-			if i == len(path) - 1:
-				n_self += 1
-			n_sub += 1
-			b[en] = (n_self, n_sub)
+			cnt = b['counts'][en]
+			if i == last:
+				cnt[0] += 1
+			cnt[1] += 1
 
 			# Sub
-			if i != len(path) - 1:
-				b = b.setdefault(c, {})
+			if i != last:
+				sub = b['children'].get(pn)
+				if sub is None:
+					sub = b['children'][pn] = self._new_node()
+				b = sub
 
 	def print(self):
 		# Print header
@@ -61,29 +75,32 @@ class UsageTracker:
 		print('|'.join(hdr1))
 		print('|'.join(hdr2))
 
-		self._print(self.usage, '/', 0, ct)
+		# Row format
+		row_fmt = '|'.join([
+			' %s%%%dd/%%%dd%s ' % (' ' * (pl // 2), cl, cl, ' ' * ((pl+1) // 2))
+				for cn, cl, pl in ct
+		]) + '| %s'
+
+		self._print(row_fmt, [cn for cn, cl, pl in ct])
 
-	def _print(self, usage, name, lvl, ct):
-		# Print usage of this node
-		p = '  ' * lvl + name
-		l = []
+	def _print(self, row_fmt, cell_types):
+		# Depth first walk of the hierarchy
+		stack = [ (self.usage, '/', 0) ]
 
-		for cn, cl, pl in ct:
-			p1 = ' ' * ( pl    // 2)
-			p2 = ' ' * ((pl+1) // 2)
-			f = ' %s%%%dd/%%%dd%s ' % (p1, cl, cl, p2)
-			u = usage.get('_'+cn, (0,0))
-			l.append(f % u)
+		while stack:
+			usage, name, lvl = stack.pop()
 
-		l.append(' ' + p)
+			# Print usage of this node
+			u = []
+			for cn in cell_types:
+				u.extend(usage['counts'].get(cn, (0,0)))
 
-		print('|'.join(l))
+			print(row_fmt % (*u, '  ' * lvl + name))
 
-		# Scan sub nodes
-		for k, v in usage.items():
-			if k.startswith('_'):
-				continue
-			self._print(v, k, lvl+1, ct)
+			# Scan sub nodes (reversed so they pop out in order)
+			stack.extend(reversed([
+				(v, k, lvl+1) for k, v in usage['children'].items()
+			]))
 
 
 # Process all cells in design